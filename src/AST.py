@@ -8,14 +8,16 @@ except:
 AST visualization given the prenex "STAR UNION a b": https://i.imgur.com/ICNRw66.png
 """
 
-graphviz_idx = 0
 class Node:
-    def __init__(self, token: str, num_children: int, children: List['Node']) -> None:
-        """ The node contains a token, a graphviz label, the number of children, and a list of children """
-        global graphviz_idx
+    __slots__ = ('token', 'graphviz_token', 'num_children', 'children')
+
+    def __init__(self, token: str, num_children: int, children: List['Node'], graphviz_idx: int = 0) -> None:
+        """
+        The node contains a token, a graphviz label, the number of children, and a list of children
+        The graphviz label is made unique using the index of the node in its AST
+        """
         self.token = token
         self.graphviz_token = token + '_' + str(graphviz_idx)
-        graphviz_idx += 1
         self.num_children = num_children
         self.children = children
 
@@ -29,24 +31,26 @@ class AST:
         Splits the given prenex expression into a list of tokens and then converts
         the tokens of the form "'c'" into "c" (this allows us to use <space> as a token)
         """
-        # Split the prenex into tokens
+        def toToken(chars: List[str]) -> str:
+            """ Joins the characters of a token, converting "'c'" to "c" """
+            token = ''.join(chars)
+            if len(token) == 3 and token[0] == "'" and token[2] == "'":
+                return token[1]
+            return token
+
+        # Split the prenex into tokens in a single pass
         tokens = []
-        token = ""
+        chars = []
         in_quotes = False
         for char in prenex:
             if char == "'":
                 in_quotes = not in_quotes
             if char == " " and not in_quotes:
-                tokens.append(token)
-                token = ""
+                tokens.append(toToken(chars))
+                chars.clear()
             else:
-                token += char
-        tokens.append(token)
-        
-        # Convert "'c'" to "c"
-        for token in tokens:
-            if len(token) == 3 and token[0] == "'" and token[2] == "'":
-                tokens[tokens.index(token)] = token[1]
+                chars.append(char)
+        tokens.append(toToken(chars))
 
         return tokens
 
@@ -103,14 +107,26 @@ class AST:
         else: # atom (c, 'c', eps, void)
             num_children = 0
 
-        return Node(token, num_children, [])
+        return Node(token, num_children, [], len(self.nodes))
 
 
     def fromPrenex(self) -> Node:
-        """ Parse the prenex expression and sets the AST's nodes """
-        token = next(self.tokens_list_iter)
-        node  = self.createNode(token)
-        self.nodes.append(node)
-        for _ in range(node.num_children):
-            node.children.append(self.fromPrenex())
-        return node
+        """
+        Parse the prenex expression and sets the AST's nodes
+        The tokens are read in pre-order, keeping a stack with the nodes that still miss
+        some children (instead of recursing), so deep expressions don't hit the recursion limit
+        """
+        root = self.createNode(next(self.tokens_list_iter))
+        self.nodes.append(root)
+        parents = [root] if root.num_children > 0 else []
+        while parents:
+            node = self.createNode(next(self.tokens_list_iter))
+            self.nodes.append(node)
+            parent = parents[-1]
+            parent.children.append(node)
+            if len(parent.children) == parent.num_children:
+                parents.pop()
+            # The next tokens are the children of this node
+            if node.num_children > 0:
+                parents.append(node)
+        return root
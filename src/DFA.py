@@ -1,4 +1,7 @@
-from typing import Callable, Generic, List, Tuple, TypeVar
+from collections import deque
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Callable, Dict, Generic, List, Tuple, TypeVar
 try:
 	from NFA import NFA
 except:
@@ -16,6 +19,8 @@ S = TypeVar("S")
 T = TypeVar("T")
 
 class DFA(Generic[S]):
+	__slots__ = ('q0', 'qfs', 'states', 'transitions', 'sink', 'alphabet', '_delta', '_qfs_set')
+
 	def __init__(self, q0: S, qfs: List[S], states: List[S], transitions: List[Tuple[S, str, S]], sink: S = None):
 		"""
 		The DFA is represented as a tuple of the form (Q, Σ, δ, q0, F)
@@ -28,6 +33,20 @@ class DFA(Generic[S]):
 		self.states = states
 		self.transitions = transitions
 		self.sink = sink
+		self._qfs_set = set(qfs)
+		self._delta: Dict[S, Dict[str, S]] = {}
+		self.buildDelta()
+
+
+	def buildDelta(self) -> None:
+		"""
+		Indexes the transitions as `δ[state][chr] -> next_state`, so `next` is a dict lookup,
+		and collects the alphabet of the DFA as a frozenset
+		"""
+		self._delta = {}
+		for q0, c, q1 in self.transitions:
+			self._delta.setdefault(q0, {}).setdefault(c, q1)
+		self.alphabet = frozenset(c for _, c, _ in self.transitions)
 
 
 	def map(self, f: Callable[[S], T]) -> 'DFA[T]':
@@ -36,15 +55,22 @@ class DFA(Generic[S]):
 					[(f(q0), c, f(q1)) for q0, c, q1 in self.transitions], f(self.sink))
 
 
+	def freeze(self) -> 'DFA[S]':
+		""" Makes the DFA read-only, so it can be shared, and returns it """
+		self.qfs = tuple(self.qfs)
+		self.states = tuple(self.states)
+		self.transitions = tuple(self.transitions)
+		self._qfs_set = frozenset(self._qfs_set)
+		self._delta = MappingProxyType({state: MappingProxyType(delta) for state, delta in self._delta.items()})
+		return self
+
+
 	def next(self, from_state: S, on_chr: str) -> S:
 		"""
 		Returns the next state given the current state and a character
 		or None if the transition is undefined
 		"""
-		for state, c, next_state in self.transitions:
-			if state == from_state and c == on_chr:
-				return next_state
-		return None
+		return self._delta.get(from_state, {}).get(on_chr)
 
 
 	def getStates(self) -> 'set[S]':
@@ -65,9 +91,73 @@ class DFA(Generic[S]):
 
 	def isFinal(self, state: S) -> bool:
 		""" Returns true if the given state is a final state """
-		return state in self.qfs
+		return state in self._qfs_set
 	
 
+	def minimize(self) -> 'DFA[int]':
+		"""
+		Minimizes the DFA using Hopcroft's partition refinement algorithm
+		https://en.wikipedia.org/wiki/DFA_minimization#Hopcroft's_algorithm
+		The states of the minimal DFA are the blocks of the final partition,
+		numbered by their smallest state (the representative of the block)
+		"""
+		alphabet = sorted(self.alphabet)
+
+		# Reverse transitions: (character, state) -> the states that reach `state` on `character`
+		inv = {}
+		for q0, c, q1 in self.transitions:
+			inv.setdefault((c, q1), set()).add(q0)
+
+		# Start from the partition {F, Q \ F} and refine it using F as the first splitter
+		finals = frozenset(self.qfs)
+		non_finals = frozenset(self.states) - finals
+		partition = set(block for block in (finals, non_finals) if block)
+		block_of = {state: block for block in partition for state in block}
+		worklist = set([finals]) if finals else set()
+
+		while worklist:
+			splitter = worklist.pop()
+			for c in alphabet:
+				# The states that reach the splitter on `c`
+				X = set()
+				for state in splitter:
+					X |= inv.get((c, state), set())
+
+				# Split every block that is only partially contained in X
+				for Y in set(block_of[state] for state in X):
+					Y_in = Y & X
+					if len(Y_in) == len(Y):
+						continue
+					Y_out = Y - X
+					partition.remove(Y)
+					partition.update((Y_in, Y_out))
+					for block in (Y_in, Y_out):
+						for state in block:
+							block_of[state] = block
+
+					# If Y was waiting to be a splitter, both halves must be used instead,
+					# otherwise it is enough to use the smaller half
+					if Y in worklist:
+						worklist.remove(Y)
+						worklist.update((Y_in, Y_out))
+					else:
+						worklist.add(min(Y_in, Y_out, key=len))
+
+		# Rebuild the DFA, the transitions of a block are the ones of its representative
+		blocks = sorted(partition, key=min)
+		block_idx = {block: idx for idx, block in enumerate(blocks)}
+		transitions = []
+		for idx, block in enumerate(blocks):
+			for c in alphabet:
+				next_state = self.next(min(block), c)
+				if next_state is not None:
+					transitions.append((idx, c, block_idx[block_of[next_state]]))
+
+		sink = block_idx[block_of[self.sink]] if self.sink is not None else None
+		return DFA(block_idx[block_of[self.q0]], [block_idx[block] for block in blocks if block <= finals],
+					list(range(len(blocks))), transitions, sink)
+
+
 	@staticmethod
 	def setToStr(states: 'set[S]') -> str:
 		"""
@@ -94,77 +184,80 @@ class DFA(Generic[S]):
 
 
 	@staticmethod
-	def fromNFA(nfa: NFA[S]) -> 'DFA[S]':
+	def fromNFA(nfa: NFA[S]) -> 'DFA[int]':
 		"""
 		Performs the subset construction algorithm to convert an NFA to a DFA
 		https://en.wikipedia.org/wiki/Powerset_construction
+		Each group of NFA states is identified by a frozenset and numbered in the order
+		it is discovered, so only the groups reachable from the initial one are built
 		"""
-		# The first group is the epsilon closure of the initial state
 		alphabet = DFA.getAlphabet(nfa)
-		q0_group = DFA.setToStr(nfa.epsilonClosures[nfa.q0])
-		dfa = DFA(q0_group, [], [q0_group], [])
 
-		# `last_groups` works like a queue, because we take the first group at each iteration
-		# (using the `for loop`) and add the new groups of state to the end of the list (using `append`)		
-		last_groups = [q0_group]
-		for last_group in last_groups:
+		# Keep the characters that each state of the NFA reacts to
+		symbols_from = {}
+		for q0, c, _ in nfa.transitions:
+			if c != 'eps':
+				symbols_from.setdefault(q0, set()).add(c)
+
+		# The first group is the epsilon closure of the initial state
+		q0_group = frozenset(nfa.epsilonClosures[nfa.q0])
+		groups = {q0_group: 0}
+		delta = {}
+
+		# BFS over the groups of states, each group is expanded exactly once
+		queue = deque([q0_group])
+		while queue:
+			group = queue.popleft()
+			state = groups[group]
+			# On the characters that no state of the group reacts to, the next group is empty
+			active = set().union(*(symbols_from.get(nfa_state, set()) for nfa_state in group))
 			for ch in alphabet:
 				next_state_group = set()
-				for state in DFA.strToSet(last_group):
-					next_states = nfa.next(state, ch)
-					for next_state in next_states:
-						next_state_group = next_state_group.union(nfa.epsilonClosures[next_state])
+				if ch in active:
+					for nfa_state in group:
+						for next_state in nfa.next(nfa_state, ch):
+							next_state_group |= nfa.epsilonClosures[next_state]
 
 				# Update the DFA
-				if DFA.setToStr(next_state_group) not in dfa.states:
-					dfa.states.append(DFA.setToStr(next_state_group))
-					last_groups.append(DFA.setToStr(next_state_group))
-				
-				# Add the transition
-				dfa.transitions.append((last_group, ch, DFA.setToStr(next_state_group)))
-		
-		# If the group contains the final state of the NFA, then the group is a final state of the DFA
-		dfa.qfs = [state for state in dfa.states if str(nfa.qf) in state]
-
-		# Map the DFA states to integers, starting from index `counter`
-		class DFAMapper():
-			def __init__(self, counter=0) -> None:
-				self.counter = counter
-				self.mapping = {}
+				next_state_group = frozenset(next_state_group)
+				if next_state_group not in groups:
+					groups[next_state_group] = len(groups)
+					queue.append(next_state_group)
 
-			def get_mapping(self, x):
-				if x not in self.mapping:
-					self.mapping[x] = self.counter
-					self.counter += 1
-
-				return self.mapping[x]
+				# Add the transition
+				delta[(state, ch)] = groups[next_state_group]
 
-		dfa = dfa.map(DFAMapper().get_mapping)
+		# If the group contains the final state of the NFA, then the group is a final state of the DFA
+		states = list(groups.values())
+		qfs = [state for group, state in groups.items() if nfa.qf in group]
+		dfa = DFA(0, qfs, states, [(q0, c, q1) for (q0, c), q1 in delta.items()])
 
 		# Set sink state
-		for state in dfa.states:
-			if all([dfa.next(state, ch) is state for ch in alphabet]) and not dfa.isFinal(state):
+		for state in states:
+			if all(delta[(state, ch)] == state for ch in alphabet) and not dfa.isFinal(state):
 				dfa.sink = state
 				break
 
-		# If there is no sink state, create one and add the undefined transitions to it
+		# If there is no sink state, create one (the subset construction already defines
+		# every other transition, so only the sink's own loops are missing)
 		if dfa.sink is None:
-			dfa.sink = len(dfa.states) + 1
+			dfa.sink = len(dfa.states)
 			dfa.states.append(dfa.sink)
-			# Append transitions to the sink state
-			for state in dfa.states:
-				for ch in alphabet:
-					if dfa.next(state, ch) is None:
-						dfa.transitions.append((state, ch, dfa.sink))
+			dfa.transitions.extend((dfa.sink, ch, dfa.sink) for ch in alphabet)
+			dfa.buildDelta()
 
 		return dfa
 
 
 	@staticmethod
+	@lru_cache(maxsize=256)
 	def fromPrenex(prenex: str) -> 'DFA[int]':
-		""" Computes the NFA from the given prenex and then converts it to a DFA """
+		"""
+		Computes the NFA from the given prenex and then converts it to a minimal DFA
+		The DFAs are cached by prenex, so the returned DFA is read-only
+		"""
 		nfa = NFA.fromPrenex(prenex)
-		return DFA.fromNFA(nfa)
+		return DFA.fromNFA(nfa).minimize().freeze()
 
 
 	def visualize(self, filename: str) -> None:
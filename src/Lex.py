@@ -1,10 +1,7 @@
 from __future__ import annotations
 from typing import Tuple, List, Dict
-from collections import defaultdict
-try:
-	from NFA import NFA
-except:
-	from src.NFA import NFA
+from collections import deque
+from bisect import bisect_left, bisect_right
 try:
     from DFA import DFA
 except:
@@ -13,6 +10,63 @@ try:
     from Parser import Parser
 except:
     from src.Parser import Parser
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# The scanner state where every token DFA is in its sink state
+SINK = -1
+
+
+def _tokenize(delta_tab, accept, word_ids, token_ids, end_idxs) -> Tuple[int, int]:
+    """
+    Splits the word into its longest matches, storing the token id and the end index of each one
+    in `token_ids` and `end_idxs` (both must have room for a match per character)
+    Every match walks the scanner DFA over the character ids of the word, keeping track of
+    the longest match, until every token DFA is in a sink or the word ended
+    Returns the number of matches and the index that failed to lex (-1 if the whole word was lexed)
+    """
+    num_matches = 0
+    start_idx = 0
+    while start_idx < len(word_ids):
+        curr_state = 0
+        longest_idx = -1
+        longest_token = -1
+        curr_idx = start_idx
+        while curr_idx < len(word_ids):
+            # Characters outside of the alphabet can't be matched by any token
+            curr_char_id = word_ids[curr_idx]
+            if curr_char_id == SINK:
+                break
+            curr_state = delta_tab[curr_state][curr_char_id]
+            # Every token DFA is in a sink state, nothing longer can be matched
+            if curr_state == SINK:
+                break
+            if accept[curr_state] != -1:
+                longest_idx = curr_idx
+                longest_token = accept[curr_state]
+            curr_idx += 1
+
+        if longest_token == -1:
+            return num_matches, curr_idx
+        token_ids[num_matches] = longest_token
+        end_idxs[num_matches] = longest_idx
+        num_matches += 1
+        start_idx = longest_idx + 1
+    return num_matches, -1
+
+
+# With Numba, the walk can be compiled to machine code (on NumPy arrays). The compiled code
+# can't be cached on disk (the module is imported both as `Lex` and as `src.Lex`, and the cache only
+# works under the name it was compiled with), so every process pays about half a second to compile it.
+# It is only used for the words long enough to make up for that
+_JIT_MIN_LEN = 1 << 20
+_tokenize_jit = njit(_tokenize) if njit is not None else None
 
 class Lexer:
     def __init__(self, configurations: Dict[str, str]) -> None:
@@ -32,38 +86,108 @@ class Lexer:
 
         # For every configuration, create a DFA and store it in a dictionary
         # The key is the token and the value is the DFA
+        # Every DFA keeps its own state ids (0..n-1), the scanner tells them apart by position
         self.dfas = {}
-        counter = 0
         for token, regex in self.configurations.items():
             prenex = Parser.toPrenex(regex)
-            nfa = NFA.fromPrenex(prenex)
-            dfa = DFA.fromNFA(nfa)
-            dfa = dfa.map(lambda x: x + counter)
-            counter += len(nfa.states)
-            self.dfas[token] = dfa
+            self.dfas[token] = DFA.fromPrenex(prenex)
+
+        self.buildScanner()
+
+
+    def buildScanner(self) -> None:
+        """
+        Combines all the token DFAs into a single scanner DFA (the product construction)
+        A scanner state is a tuple with the current state of every token DFA, and it
+        accepts the token with the highest priority (the first one in the configuration,
+        stored as its index in `self.tokens`) whose DFA is in a final state.
+        The scanner states where every DFA is in a sink are merged into `SINK`,
+        meaning that nothing longer can be matched. Only the DFAs that are still
+        alive (not in their sink) are advanced when expanding a scanner state
 
+        The transitions are stored as a dense table `δ[state][char_id]`, where the
+        characters are numbered by their position in the sorted alphabet
+        If Numba is installed, the tables are also kept as NumPy arrays for `_tokenize_jit`
+        """
+        self.tokens = list(self.dfas.keys())
+        dfas = list(self.dfas.values())
+        alphabet = sorted(set().union(*(dfa.alphabet for dfa in dfas)))
+        self._char_id: Dict[str, int] = {ch: idx for idx, ch in enumerate(alphabet)}
+        self._delta_tab: List[List[int]] = []
+        self._accept: List[int] = []
+
+        sinks = tuple(dfa.sink for dfa in dfas)
+
+        # Re-index the transitions of every token DFA by the scanner character ids,
+        # so expanding a scanner state only does integer list indexing
+        # (the DFAs from `DFA.fromPrenex` number their states 0..n-1)
+        dfa_tabs = []
+        for dfa in dfas:
+            dfa_tab = [[dfa.sink] * len(alphabet) for _ in dfa.states]
+            for q0, c, q1 in dfa.transitions:
+                dfa_tab[q0][self._char_id[c]] = q1
+            dfa_tabs.append(dfa_tab)
+
+        q0 = tuple(dfa.q0 for dfa in dfas)
+        scanner_states = {q0: 0}
+
+        # The states are numbered in the order they are discovered (and expanded),
+        # so the row of each state is appended at its own index
+        queue = deque([q0])
+        while queue:
+            curr_states = queue.popleft()
+            # The indices of the DFAs that are still alive, in priority order
+            live = [i for i, state in enumerate(curr_states) if state != sinks[i]]
+            self._accept.append(next((i for i in live if curr_states[i] in dfas[i]._qfs_set), -1))
+            row = [SINK] * len(alphabet)
+            for char_id in range(len(alphabet)):
+                next_states = list(sinks)
+                any_live = False
+                for i in live:
+                    # Undefined transitions of a token DFA lead to its sink
+                    next_state = dfa_tabs[i][curr_states[i]][char_id]
+                    if next_state != sinks[i]:
+                        next_states[i] = next_state
+                        any_live = True
+                if not any_live:
+                    continue
+                next_states = tuple(next_states)
+                if next_states not in scanner_states:
+                    scanner_states[next_states] = len(scanner_states)
+                    queue.append(next_states)
+                row[char_id] = scanner_states[next_states]
+            self._delta_tab.append(row)
+
+        # Lookup table for translating latin-1 words to character ids in bulk (see `charIds`)
+        if np is not None:
+            self._char_id_lut = np.full(256, SINK, dtype=np.int32)
+            for ch, idx in self._char_id.items():
+                if len(ch) == 1 and ord(ch) < 256:
+                    self._char_id_lut[ord(ch)] = idx
+
+        if njit is not None:
+            self._delta_arr = np.array(self._delta_tab, dtype=np.int32).reshape(len(self._delta_tab), len(alphabet))
+            self._accept_arr = np.array(self._accept, dtype=np.int32)
 
-    def getLongestMatch(self, matchesDict) -> Tuple[str, int] | None:
+
+    def charIds(self, word: str, as_array: bool = False) -> List[int]:
         """
-        Given a list of matches, returns the longest match
-        If there are multiple longest matches, returns the one with the highest priority
-        If the list is empty, returns None
+        Translates every character of the word to its id in the scanner alphabet
+        (or `SINK` for the characters outside of the alphabet)
+        If NumPy is installed, latin-1 words are translated at once using a lookup table
+        The ids are returned as a NumPy array if `as_array` is set (for `_tokenize_jit`), as a list otherwise
         """
-        # If there are no matches, return None
-        if len(matchesDict) == 0:
-            return None
-
-        # Get the longest match and traverse the list backwards
-        # in order to get the longest match with the highest priority
-        longestMatchIdx   = 0
-        longestMatchToken = None
-        for token, matches in reversed(matchesDict.items()):
-            for match in matches:
-                if match >= longestMatchIdx:
-                    longestMatchIdx = match
-                    longestMatchToken = token
-        
-        return (longestMatchToken, longestMatchIdx)
+        if np is not None:
+            try:
+                codes = np.frombuffer(word.encode('latin-1'), dtype=np.uint8)
+            except UnicodeEncodeError:
+                pass
+            else:
+                word_ids = self._char_id_lut[codes]
+                return word_ids if as_array else word_ids.tolist()
+        char_id = self._char_id
+        word_ids = [char_id.get(ch, SINK) for ch in word]
+        return np.array(word_ids, dtype=np.int32) if as_array else word_ids
 
 
     def lex(self, word: str) -> List[Tuple[str, str]] | str:
@@ -73,61 +197,46 @@ class Lexer:
         The return value is either a List of tuples (TOKEN, LEXEM) if the lexer succedes
         or a string message if the lexer fails
         """
+        # Walk the scanner DFA from the start of every match, keeping track of the longest match
+        # (the scanner states already accept the token with the highest priority)
+        # There is room for a match per character
+        if _tokenize_jit is not None and len(word) >= _JIT_MIN_LEN:
+            word_ids = self.charIds(word, as_array=True)
+            token_ids = np.empty(len(word), dtype=np.int32)
+            end_idxs  = np.empty(len(word), dtype=np.int64)
+            num_matches, failed_curr_idx = _tokenize_jit(self._delta_arr, self._accept_arr, word_ids, token_ids, end_idxs)
+        else:
+            word_ids = self.charIds(word)
+            token_ids = [0] * len(word)
+            end_idxs  = [0] * len(word)
+            num_matches, failed_curr_idx = _tokenize(self._delta_tab, self._accept, word_ids, token_ids, end_idxs)
+
+        # If the whole word couldn't be lexed, return an error message
+        # Failed index is the highest index that failed to lex
+        if failed_curr_idx != -1:
+            # The positions of the newlines are only needed when reporting an error
+            newlines = [i for i, char in enumerate(word) if char == '\n']
+            # Single line input
+            if len(newlines) == 0:
+                if failed_curr_idx == len(word):
+                    return f'No viable alternative at character EOF, line 0'
+                else:
+                    return f'No viable alternative at character {failed_curr_idx}, line 0'
+            # Multiple lines input - compute the line number and the character index in that specific line
+            else:
+                # The line is the number of newlines up to (and including) `failed_curr_idx`
+                line = bisect_right(newlines, failed_curr_idx)
+                if failed_curr_idx == len(word):
+                    return f'No viable alternative at character EOF, line {line}'
+                # Compute `failed_curr_idx` in the current line, relative to the previous newline
+                prev_newline_idx = bisect_left(newlines, failed_curr_idx) - 1
+                failed_curr_idx = failed_curr_idx - (newlines[prev_newline_idx] if prev_newline_idx >= 0 else -1)
+                return f'No viable alternative at character {failed_curr_idx}, line {line}'
+
         output = []
         start_idx = 0
-        # While there are still characters to lex
-        while start_idx < len(word):
-            matches = defaultdict(list[tuple[int, int]])
-            num_sinks = 0
-            failed_curr_idx = 0
-            
-            # For every DFA, try to match the longest possible string
-            for token, dfa in self.dfas.items():
-                curr_idx = start_idx
-                curr_state = dfa.q0
-                # While there are still characters to lex and the current state is not a sink
-                while curr_idx < len(word):
-                    # Get the next state based on the current state and the current character
-                    curr_char  = word[curr_idx]
-                    curr_state = dfa.next(curr_state, curr_char)
-                    # If the current state is a final state, save the index and the state
-                    if curr_state in dfa.qfs:
-                        matches[token].append(curr_idx)
-                    # If the current state is a sink, count the number of sinks and break
-                    if curr_state == None or curr_state == dfa.sink:
-                        num_sinks += 1
-                        break
-                    curr_idx += 1
-                # Failed index is the highest index that failed to lex
-                failed_curr_idx = max(failed_curr_idx, curr_idx)
-                # Stop the loop if all the DFAs are in a sink state (don't waste time by looping in the sink)
-                if num_sinks == len(self.dfas):
-                    break
-
-            # Try to get the longest match, but if there are no matches, return an error message
-            try:
-                longestToken, longestIdx = self.getLongestMatch(matches)
-                output.append((longestToken, word[start_idx : longestIdx + 1]))
-                start_idx = longestIdx + 1
-            except:
-                # Single line input
-                if word.count('\n') == 0:
-                    if failed_curr_idx == len(word):
-                        return f'No viable alternative at character EOF, line 0'
-                    else:
-                        return f'No viable alternative at character {failed_curr_idx}, line 0'
-                # Multiple lines input - compute the line number and the character index in that specific line
-                else:
-                    line = 0
-                    for i, char in enumerate(word):
-                        if char == '\n':
-                            line += 1
-                        if i == failed_curr_idx:
-                            break
-                    if failed_curr_idx == len(word):
-                        return f'No viable alternative at character EOF, line {line}'
-                    # Compute `failed_curr_idx` in the current line
-                    failed_curr_idx = failed_curr_idx - word[:failed_curr_idx].rfind('\n')
-                    return f'No viable alternative at character {failed_curr_idx}, line {line}'
+        for token_id, end_idx in zip(token_ids[:num_matches], end_idxs[:num_matches]):
+            output.append((self.tokens[token_id], word[start_idx : end_idx + 1]))
+            start_idx = end_idx + 1
 
         return output
@@ -1,3 +1,4 @@
+from collections import deque
 from typing import Callable, Generic, List, Tuple, TypeVar, Dict
 try:
 	from AST import AST, Node
@@ -15,11 +16,23 @@ NFA visualization given the prenex "STAR UNION a b": https://i.imgur.com/Mju3lGb
 S = TypeVar("S")
 T = TypeVar("T")
 
-curr_state_idx = 0
-visited = set()
+EMPTY_SET = frozenset()
+
+class StateCounter:
+	def __init__(self) -> None:
+		""" Hands out consecutive state indices while an NFA is being built """
+		self.idx = 0
+
+	def fresh(self) -> int:
+		""" Returns a new, unused state index """
+		self.idx += 1
+		return self.idx - 1
+
 
 class NFA(Generic[S]):
-	def __init__(self, q0: S, qf: S, states: List[S], transitions: List[Tuple[S, str, S]], epsilonCloures: Dict = {}) -> None:
+	__slots__ = ('q0', 'qf', 'states', 'transitions', 'epsilonClosures', '_delta_nfa')
+
+	def __init__(self, q0: S, qf: S, states: List[S], transitions: List[Tuple[S, str, S]], epsilonClosures: Dict = None) -> None:
 		"""
 		Thompson's construction ensures that the obtained automaton has
 		exactly one initial state and exactly one final state (`q0` and `qf`)
@@ -29,22 +42,35 @@ class NFA(Generic[S]):
 		self.qf = qf
 		self.states = states
 		self.transitions = transitions
-		self.epsilonClosures = epsilonCloures
-		self.currentEpsilonClosure = set()
+		self.epsilonClosures = {} if epsilonClosures is None else epsilonClosures
+		self._delta_nfa: Dict[Tuple[S, str], 'frozenset[S]'] = None
 
 
 	def map(self, f: Callable[[S], T]) -> 'NFA[T]':
 		""" Maps the states of type `S` of the DFA to a new type `T` """
 		mappedEpsilonClosures = {}
 		for state, epsCl in self.epsilonClosures.items():
-			mappedEpsilonClosures[f(state)] = [f(s) for s in epsCl]
+			mappedEpsilonClosures[f(state)] = frozenset(f(s) for s in epsCl)
 		return NFA(f(self.q0), f(self.qf), [f(s) for s in self.states],
 					[(f(q0), c, f(q1)) for q0, c, q1 in self.transitions], mappedEpsilonClosures)
 
 
-	def next(self, from_state: S, on_chr: str) -> 'set[S]':
-		""" Returns the next states from the current state on the given character """
-		return set([q1 for q0, c, q1 in self.transitions if q0 == from_state and c == on_chr])
+	def buildDelta(self) -> None:
+		""" Indexes the transitions as `δ[(state, chr)] -> next_states`, so `next` is a dict lookup """
+		delta = {}
+		for q0, c, q1 in self.transitions:
+			delta.setdefault((q0, c), set()).add(q1)
+		self._delta_nfa = {key: frozenset(next_states) for key, next_states in delta.items()}
+
+
+	def next(self, from_state: S, on_chr: str) -> 'frozenset[S]':
+		"""
+		Returns the next states from the current state on the given character
+		The index of the transitions is built on the first call
+		"""
+		if self._delta_nfa is None:
+			self.buildDelta()
+		return self._delta_nfa.get((from_state, on_chr), EMPTY_SET)
 
 
 	def getStates(self) -> 'set[S]':
@@ -52,60 +78,52 @@ class NFA(Generic[S]):
 		return set(self.states)
 
 
-	def computeEpsilonClosure(self, state: S) -> 'set[S]':
-		""" Returns the epsilon closure of the given state """
-		global visited
-		self.currentEpsilonClosure = set()
-		visited = set()
-
-		def computeEpsilonClosureHelper(self, state: S) -> None:
-			"""
-			Generates the epsilon closure of the current state (using DFS traversal)
-			E(q) = {state q, all states reachable by epsilon transitions from q}
-			"""
-			# Keep track of the visited states to avoid infinite epsilon loops
-			visited.add(state)
-			self.currentEpsilonClosure.add(state)
+	def epsilonAdjacency(self) -> 'Dict[S, List[S]]':
+		""" Groups the epsilon transitions of the NFA by their source state """
+		eps_adj = {}
+		for q0, c, q1 in self.transitions:
+			if c == 'eps':
+				eps_adj.setdefault(q0, []).append(q1)
+		return eps_adj
 
-			# Get all the states that can be reached from the current state on epsilon
-			next_states = self.next(state, 'eps')
 
-			# For each of these unvisited states, get their epsilon closure and add it to the current closure
-			for next_state in next_states:
-				if next_state not in visited:
-					computeEpsilonClosureHelper(self, next_state)
+	def computeEpsilonClosure(self, state: S, eps_adj: 'Dict[S, List[S]]' = None) -> 'frozenset[S]':
+		"""
+		Returns the epsilon closure of the given state (using BFS traversal)
+		E(q) = {state q, all states reachable by epsilon transitions from q}
+		The adjacency of the epsilon transitions can be passed in when computing many closures
+		"""
+		if eps_adj is None:
+			eps_adj = self.epsilonAdjacency()
 
-		computeEpsilonClosureHelper(self, state)
-		return self.currentEpsilonClosure
+		# The closure also keeps track of the visited states to avoid infinite epsilon loops
+		closure = {state}
+		queue = deque([state])
+		while queue:
+			for next_state in eps_adj.get(queue.popleft(), []):
+				if next_state not in closure:
+					closure.add(next_state)
+					queue.append(next_state)
+		return frozenset(closure)
 
 
 	def accepts(self, str: str) -> bool:
-		""" Returns true if the NFA accepts the given string, false otherwise """
-		def acceptsHelper(self, expr: str, state: S) -> bool:
-			"""
-			Try all the possible paths from the current state to the final state
-			If we reach the final state, then the NFA accepts the string
-			If we don't reach the final state, then the NFA rejects the string
-			"""
-			# The string is consumed and the current state is a final state
-			# or we can reach a final state from the current state by epsilon transitions
-			if expr == '':
-				return self.isFinal(state) or any(self.isFinal(state) for state in self.epsilonClosures[state])
-
-			# The string is not consumed and compute all character transitions
-			for next_state in self.next(state, expr[0]):
-				if acceptsHelper(expr[1:], next_state):
-					return True
-			
-			# The string is not consumed and compute all epsilon transitions
-			for next_state in self.next(state, 'eps'):
-				if acceptsHelper(expr, next_state):
-					return True
-
-			# If we couldn't find a path to a final state, then the NFA doesn't accept the string
-			return False
-
-		return acceptsHelper(self, str, self.q0)
+		"""
+		Returns true if the NFA accepts the given string, false otherwise
+		Simulates the NFA by keeping the set of all the states it can currently be in,
+		so no path is explored twice (using the precomputed epsilon closures)
+		"""
+		curr_states = set(self.epsilonClosures[self.q0])
+		for ch in str:
+			next_states = set()
+			for state in curr_states:
+				for next_state in self.next(state, ch):
+					next_states |= self.epsilonClosures[next_state]
+			curr_states = next_states
+			# No state can be reached, the NFA rejects the string
+			if not curr_states:
+				return False
+		return self.qf in curr_states
 
 
 	def isFinal(self, state: S) -> bool:
@@ -113,57 +131,69 @@ class NFA(Generic[S]):
 		return state == self.qf
 
 
-	def atomNFA(ch: str) -> 'NFA[S]':
+	def atomNFA(ch: str, counter: StateCounter) -> 'NFA[int]':
 		""" Computes the NFA for the given atom (c, 'c', eps, void) """
-		global curr_state_idx
-		q0 = curr_state_idx
-		qf = curr_state_idx + 1
-		curr_state_idx += 2
+		q0 = counter.fresh()
+		qf = counter.fresh()
 		return NFA(q0, qf, [q0, qf], [(q0, ch, qf)])
 
 
-	def concatNFA(nfa1: 'NFA[S]', nfa2: 'NFA[S]') -> 'NFA[S]':
+	# The combinators below build the new NFA in place, on top of `nfa1` (or `nfa`),
+	# extending its lists of states and transitions instead of copying them
+	# (this also invalidates the index of the transitions used by `next`)
+	def concatNFA(nfa1: 'NFA[int]', nfa2: 'NFA[int]') -> 'NFA[int]':
 		""" Given 2 NFAs, returns a new NFA that accepts the `concatenation` of the languages of the 2 NFAs """
-		global curr_state_idx
-		q0 = nfa1.q0
-		qf = nfa2.qf
-		return NFA(q0, qf, nfa1.states + nfa2.states,
-					[(nfa1.qf, 'eps', nfa2.q0)] + nfa1.transitions + nfa2.transitions)
+		nfa1.states.extend(nfa2.states)
+		nfa1.transitions.extend(nfa2.transitions)
+		nfa1.transitions.append((nfa1.qf, 'eps', nfa2.q0))
+		nfa1.qf = nfa2.qf
+		nfa1._delta_nfa = None
+		return nfa1
 
 
-	def unionNFA(nfa1: 'NFA[S]', nfa2: 'NFA[S]') -> 'NFA[S]':
+	def unionNFA(nfa1: 'NFA[int]', nfa2: 'NFA[int]', counter: StateCounter) -> 'NFA[int]':
 		""" Given 2 NFAs, returns a new NFA that accepts the `union` of the languages of the 2 NFAs """
-		global curr_state_idx
-		q0 = curr_state_idx
-		qf = curr_state_idx + 1
-		curr_state_idx += 2
-		return NFA(q0, qf, [q0, qf] + nfa1.states + nfa2.states,
-					[(q0, 'eps', nfa1.q0), (q0, 'eps', nfa2.q0), (nfa1.qf, 'eps', qf), (nfa2.qf, 'eps', qf)] + nfa1.transitions + nfa2.transitions)
-
-
-	def starNFA(nfa: 'NFA[S]') -> 'NFA[S]':
+		q0 = counter.fresh()
+		qf = counter.fresh()
+		nfa1.states.extend(nfa2.states)
+		nfa1.states.extend((q0, qf))
+		nfa1.transitions.extend(nfa2.transitions)
+		nfa1.transitions.extend([(q0, 'eps', nfa1.q0), (q0, 'eps', nfa2.q0), (nfa1.qf, 'eps', qf), (nfa2.qf, 'eps', qf)])
+		nfa1.q0 = q0
+		nfa1.qf = qf
+		nfa1._delta_nfa = None
+		return nfa1
+
+
+	def starNFA(nfa: 'NFA[int]', counter: StateCounter) -> 'NFA[int]':
 		""" Given an NFA, returns a new NFA that accepts the `Kleene star` of the language of the given NFA """
-		global curr_state_idx
-		q0 = curr_state_idx
-		qf = curr_state_idx + 1
-		curr_state_idx += 2
-		return NFA(q0, qf, [q0, qf] + nfa.states,
-					[(q0, 'eps', nfa.q0), (nfa.qf, 'eps', qf), (q0, 'eps', qf), (nfa.qf, 'eps', nfa.q0)] + nfa.transitions)
+		q0 = counter.fresh()
+		qf = counter.fresh()
+		nfa.states.extend((q0, qf))
+		nfa.transitions.extend([(q0, 'eps', nfa.q0), (nfa.qf, 'eps', qf), (q0, 'eps', qf), (nfa.qf, 'eps', nfa.q0)])
+		nfa.q0 = q0
+		nfa.qf = qf
+		nfa._delta_nfa = None
+		return nfa
 
 
-	def plusNFA(nfa: 'NFA[S]') -> 'NFA[S]':
+	def plusNFA(nfa: 'NFA[int]', counter: StateCounter) -> 'NFA[int]':
 		""" Given an NFA, returns a new NFA that accepts the `plus` of the language of the given NFA """
-		global curr_state_idx
-		q0 = curr_state_idx
-		qf = curr_state_idx + 1
-		curr_state_idx += 2
-		return NFA(q0, qf, [q0, qf] + nfa.states,
-					[(q0, 'eps', nfa.q0), (nfa.qf, 'eps', qf), (nfa.qf, 'eps', nfa.q0)] + nfa.transitions)
+		q0 = counter.fresh()
+		qf = counter.fresh()
+		nfa.states.extend((q0, qf))
+		nfa.transitions.extend([(q0, 'eps', nfa.q0), (nfa.qf, 'eps', qf), (nfa.qf, 'eps', nfa.q0)])
+		nfa.q0 = q0
+		nfa.qf = qf
+		nfa._delta_nfa = None
+		return nfa
 
 
-	def maybeNFA(nfa: 'NFA[S]') -> 'NFA[S]':
+	def maybeNFA(nfa: 'NFA[int]') -> 'NFA[int]':
 		""" Given an NFA, returns a new NFA that accepts the `maybe` of the language of the given NFA """
-		return NFA(nfa.q0, nfa.qf, nfa.states, [(nfa.q0, 'eps', nfa.qf)] + nfa.transitions)
+		nfa.transitions.append((nfa.q0, 'eps', nfa.qf))
+		nfa._delta_nfa = None
+		return nfa
 
 
 	@staticmethod
@@ -186,34 +216,57 @@ class NFA(Generic[S]):
 
 
 	@staticmethod
-	def fromAST(root: Node) -> 'NFA[int]':
-		"""  Recursively builds an NFA from the given regular expression (in prenex form) """
-		if NFA.isAtom(root.token):
-			return NFA.atomNFA(root.token)
-		if root.token == 'STAR':
-			return NFA.starNFA(NFA.fromAST(root.children[0]))
-		if root.token == 'PLUS':
-			return NFA.plusNFA(NFA.fromAST(root.children[0]))
-		if root.token == 'MAYBE':
-			return NFA.maybeNFA(NFA.fromAST(root.children[0]))
-		if root.token == 'CONCAT':
-			return NFA.concatNFA(NFA.fromAST(root.children[0]), NFA.fromAST(root.children[1]))
-		if root.token == 'UNION':
-			return NFA.unionNFA(NFA.fromAST(root.children[0]), NFA.fromAST(root.children[1]))
+	def fromAST(root: Node, counter: StateCounter = None) -> 'NFA[int]':
+		"""
+		Builds an NFA from the given regular expression (in prenex form)
+		The AST is traversed in post-order using an explicit stack, so deep expressions
+		don't hit the recursion limit. The NFAs of the children are kept on a second stack
+		"""
+		if counter is None:
+			counter = StateCounter()
+
+		nodes = [(root, False)]
+		nfas = []
+		while nodes:
+			node, children_built = nodes.pop()
+			if NFA.isAtom(node.token):
+				nfas.append(NFA.atomNFA(node.token, counter))
+				continue
+
+			# Build the children first (from left to right), then come back to this node
+			if not children_built:
+				nodes.append((node, True))
+				nodes.extend((child, False) for child in reversed(node.children))
+				continue
+
+			if node.token == 'STAR':
+				nfas.append(NFA.starNFA(nfas.pop(), counter))
+			elif node.token == 'PLUS':
+				nfas.append(NFA.plusNFA(nfas.pop(), counter))
+			elif node.token == 'MAYBE':
+				nfas.append(NFA.maybeNFA(nfas.pop()))
+			elif node.token == 'CONCAT':
+				nfa2 = nfas.pop()
+				nfas.append(NFA.concatNFA(nfas.pop(), nfa2))
+			elif node.token == 'UNION':
+				nfa2 = nfas.pop()
+				nfas.append(NFA.unionNFA(nfas.pop(), nfa2, counter))
+			else:
+				raise ValueError(f"Unknown token `{node.token}`")
+
+		return nfas.pop()
 
 
 	@staticmethod
 	def fromPrenex(prenex: str) -> 'NFA[int]':
 		""" Computes the AST from the given regular expression and then builds an NFA from it """
-		global curr_state_idx, visited
-		curr_state_idx = 0
 		ast = AST(prenex)
 		ast.fromPrenex()
-		nfa = NFA.fromAST(ast.getRoot())
-		# Compute the epsilon closure of each state and reset some global vars
+		nfa = NFA.fromAST(ast.getRoot(), StateCounter())
+		# Compute the epsilon closure of each state, sharing a single epsilon adjacency
+		eps_adj = nfa.epsilonAdjacency()
 		for state in nfa.states:
-			nfa.epsilonClosures[state] = nfa.computeEpsilonClosure(state)
-		visited = set()
+			nfa.epsilonClosures[state] = nfa.computeEpsilonClosure(state, eps_adj)
 		return nfa
 
 
@@ -1,20 +1,39 @@
 from __future__ import annotations
+from functools import lru_cache
+from itertools import chain, islice, repeat
 try:
-    from src.Regex import Character, Operator
+    from src.Regex import Operator, T_CHR, T_LB, T_RB, T_STAR, T_PLUS, T_MAYBE, T_UNION, T_CONCAT
 except:
-    from Regex import Character, Operator
+    from Regex import Operator, T_CHR, T_LB, T_RB, T_STAR, T_PLUS, T_MAYBE, T_UNION, T_CONCAT
 
-STAR    = Operator("*")
-PLUS    = Operator("+")
-MAYBE   = Operator("?")
-UNION   = Operator("|")
-CONCAT  = Operator(".")
-L_BRACK = Operator("(")
-R_BRACK = Operator(")")
+# Maps every operator character to its tag
+OP_TAGS = {'(': T_LB, ')': T_RB, '*': T_STAR, '+': T_PLUS, '?': T_MAYBE, '|': T_UNION, '.': T_CONCAT}
+
+# The tags that can be followed by a concatenation (a, ), *, +, ?) and the tags that can follow one (a, ()
+_LEFT_CONCAT  = bytes((T_CHR, T_RB, T_STAR, T_PLUS, T_MAYBE))
+_RIGHT_CONCAT = bytes((T_CHR, T_LB))
+
+# Escaped whitespace characters keep their quotes (this allows us to use them as tokens)
+_ESCAPED = {c: f"'{c}'" for c in "\n\t\r "}
+
+# The priority of every operator tag, looked up by the shunting-yard
+# (the brackets have the lowest priority, so they stop the popping of the operators)
+_PRIO = {tag: Operator.priority(c) for c, tag in OP_TAGS.items()}
+
+# The name of every operator tag in the prenex form (the brackets never reach the output)
+_NAMES = {T_STAR: 'STAR', T_PLUS: 'PLUS', T_MAYBE: 'MAYBE', T_UNION: 'UNION', T_CONCAT: 'CONCAT'}
+
+
+@lru_cache(maxsize=128)
+def _expand_class(first: str, last: str) -> tuple[bytes, tuple[str, ...]]:
+    """ Expands the special input [first-last] to its tags and characters, e.g. [0-9] -> (0|1|2|3|4|5|6|7|8|9) """
+    tags = bytes((T_LB, *(T_CHR, T_UNION) * (ord(last) - ord(first)), T_CHR, T_RB))
+    chars = ('(', *chain.from_iterable((chr(j), '|') for j in range(ord(first), ord(last))), last, ')')
+    return tags, chars
 
 class Parser:
     @staticmethod
-    def addConcatOp(rlist: list[Character | Operator]) -> list[Character | Operator]:
+    def addConcatOp(tags: bytearray, chars: list[str]) -> tuple[bytearray, list[str]]:
         """
         Adds concatenation operator between items in the list in the following cases:
         - ab
@@ -23,58 +42,42 @@ class Parser:
         - )(
         - *a, +a, ?a
         - *(, +(, ?(
+        Only the tags are needed to decide, the characters are copied along
         """
-        # If the list has only one item, it is not needed to add concatenation
-        if len(rlist) == 1:
-            return rlist
-
-        out = []
-        i = 0
-        for i in range(len(rlist) - 1):
-            if isinstance(rlist[i], Character) and isinstance(rlist[i + 1], Character): # ab
-                out.append(rlist[i])
-                out.append(CONCAT)
-            elif isinstance(rlist[i], Character) and rlist[i + 1] == L_BRACK: # a(
-                out.append(rlist[i])
-                out.append(CONCAT)
-            elif rlist[i] == R_BRACK and isinstance(rlist[i + 1], Character): # )a
-                out.append(rlist[i])
-                out.append(CONCAT)
-
-            elif rlist[i] == R_BRACK and rlist[i + 1] == L_BRACK: # )(
-                out.append(rlist[i])
-                out.append(CONCAT)
-
-            elif rlist[i] == STAR and isinstance(rlist[i + 1], Character): # *a
-                out.append(rlist[i])
-                out.append(CONCAT)
-            elif rlist[i] == PLUS and isinstance(rlist[i + 1], Character): # +a
-                out.append(rlist[i])
-                out.append(CONCAT)
-            elif rlist[i] == MAYBE and isinstance(rlist[i + 1], Character): # ?a
-                out.append(rlist[i])
-                out.append(CONCAT)
-
-            elif rlist[i] == STAR and rlist[i + 1] == L_BRACK: # *(
-                out.append(rlist[i])
-                out.append(CONCAT)
-            elif rlist[i] == PLUS and rlist[i + 1] == L_BRACK: # +(
-                out.append(rlist[i])
-                out.append(CONCAT)
-            elif rlist[i] == MAYBE and rlist[i + 1] == L_BRACK: # ?(
-                out.append(rlist[i])
-                out.append(CONCAT)
-            else:
-                out.append(rlist[i])
-                
-        out.append(rlist[i + 1])
-        return out
+        # If the list has at most one item, it is not needed to add concatenation
+        if len(tags) <= 1:
+            return tags, chars
+
+        # At most one concatenation is added between two items, so the output is allocated once
+        # (with room for 2n-1 items) and trimmed at the end
+        n = len(tags)
+        out_tags = bytearray(2 * n - 1)
+        out_chars = [None] * (2 * n - 1)
+        k = 0
+        left_concat, right_concat = _LEFT_CONCAT, _RIGHT_CONCAT
+        # Walk the pairs of adjacent tags, without copying the tags (the last item is copied after the loop)
+        for l, r, c in zip(tags, islice(tags, 1, None), chars):
+            out_tags[k] = l
+            out_chars[k] = c
+            k += 1
+            if l in left_concat and r in right_concat:
+                out_tags[k] = T_CONCAT
+                out_chars[k] = '.'
+                k += 1
+
+        out_tags[k] = tags[-1]
+        out_chars[k] = chars[-1]
+        k += 1
+        del out_tags[k:]
+        del out_chars[k:]
+        return out_tags, out_chars
 
 
     @staticmethod
-    def preprocess(regex: str) -> list[Character | Operator]:
+    def preprocess(regex: str) -> tuple[bytearray, list[str]]:
         """
-        Preprocess the regex string and returns a list of characters and operators
+        Preprocess the regex string and returns its items as two parallel sequences:
+        the tags of the items (see `Regex.py`) and their characters (for the operators, the operator character)
         -> Classify input as either character(or string) or operator
         -> Convert special inputs like [0-9], [a-z] and [A-Z] to their correct form
         -> Convert escaped characters
@@ -82,154 +85,153 @@ class Parser:
         # Replace "eps" with "ε"
         regex = regex.replace("eps", "ε")
 
+        # Most regexes have no escaped characters and no special inputs, so every character is an item
+        if "'" not in regex and '[' not in regex:
+            return Parser.preprocessSimple(regex)
+        return Parser.preprocessWithClasses(regex)
+
+
+    @staticmethod
+    def preprocessSimple(regex: str) -> tuple[bytearray, list[str]]:
+        """ Preprocess a regex without escaped characters and special inputs (see `preprocess()`) """
+        # Every character is either an operator or a character
+        tags = bytearray(map(OP_TAGS.get, regex, repeat(T_CHR, len(regex))))
+        return Parser.addConcatOp(tags, list(regex))
+
+
+    @staticmethod
+    def preprocessWithClasses(regex: str) -> tuple[bytearray, list[str]]:
+        """ Preprocess a regex that may have escaped characters and special inputs (see `preprocess()`) """
         # Classify input as either character(or string) or operator
-        rlist = []
+        tags = bytearray()
+        chars = []
+        add_tag = tags.append
+        add_chr = chars.append
+        n = len(regex)
         i = 0
-        while i < len(regex):
+        while i < n:
+            c = regex[i]
+            # Operators
+            tag = OP_TAGS.get(c)
+            if tag is not None:
+                add_tag(tag)
+                add_chr(c)
+                i += 1
+                continue
+
             # Escaped characters
-            if regex[i] == "\'":
+            if c == "\'":
                 i += 1 # Skip the first \' character
-                if regex[i] == "\n":
-                    rlist.append(Character("'\n'"))
-                elif regex[i] == "\t":
-                    rlist.append(Character("'\t'"))
-                elif regex[i] == "\r":
-                    rlist.append(Character("'\r'"))
-                elif regex[i] == " ":
-                    rlist.append(Character("' '"))
-                else:
-                    rlist.append(Character(regex[i]))
+                c = regex[i]
+                add_tag(T_CHR)
+                add_chr(_ESCAPED.get(c, c))
                 i += 1 # Skip the last \' character
-            # Operators
-            elif regex[i] == '(':
-                rlist.append(L_BRACK)
-            elif regex[i] == ')':
-                rlist.append(R_BRACK)
-            elif regex[i] == '*':
-                rlist.append(STAR)
-            elif regex[i] == '+':
-                rlist.append(PLUS)
-            elif regex[i] == '?':
-                rlist.append(MAYBE)
-            elif regex[i] == '|':
-                rlist.append(UNION)
-            elif regex[i] == '.':
-                rlist.append(CONCAT)
             # Special inputs like [0-9], [a-z] and [A-Z]
-            elif regex[i] == '[':
+            elif c == '[':
                 # [0-9] -> (0|1|2|3|4|5|6|7|8|9)
-                first = regex[i + 1]
-                last  = regex[i + 3]
-                rlist.append(L_BRACK)
-                for j in range(ord(first), ord(last)):
-                    rlist.append(Character(chr(j)))
-                    rlist.append(UNION)
-                rlist.append(Character(last))
-                rlist.append(R_BRACK)
+                class_tags, class_chars = _expand_class(regex[i + 1], regex[i + 3])
+                tags.extend(class_tags)
+                chars.extend(class_chars)
                 i += 4 # Skip the last ] character
             else:
-                rlist.append(Character(regex[i]))
+                add_tag(T_CHR)
+                add_chr(c)
             i += 1
 
         # Add concatenation operator
-        # print(rlist)
-        rlist = Parser.addConcatOp(rlist)
-        # print(rlist)
-        return rlist
+        return Parser.addConcatOp(tags, chars)
 
 
     @staticmethod
-    def toPrenexHelper(regex: list[Character | Operator]) -> str:
+    def toPrenexHelper(tags: bytearray, chars: list[str]) -> str:
         """
-        Given a list of Character and Operator instances, convert it to prenex form
-        For this, use a stack to keep track of the operators
+        Given the tags and characters of the items (in infix form), convert them to prenex form
+        For this, traverse the items from right to left and use a stack to keep track of the operator tags
+        (when reading from right to left, a `right bracket` opens a group and a `left bracket` closes it)
 
         Based on the current item, perform the following operations:
             - If the current item is an `character`, add it to the output
-            - If the item is a `left bracket`, push it to the stack
-            - If the item is a `right bracket`, pop all the operators from the stack and add them to the output
-            until find a left bracket. Then pop the left bracket from the stack
+            - If the item is a `right bracket`, push it to the stack
+            - If the item is a `left bracket`, pop all the operators from the stack and add them to the output
+            until find a right bracket. Then pop the right bracket from the stack
             - If the item is an `operator`, pop all the operators with higher (or equal for STAR operator) precedence
             from the stack and add them to the output. Then push the current operator to the stack
 
-        Clear the stack and add all the items to the output
-        At the end, reverse the output and convert from regex symbols to prenex symbols
+        Clear the stack (up to the right bracket it was seeded with) and add all the items to the output
+        A left bracket that reaches the seeded right bracket, or a right bracket left on the stack, means
+        that the brackets are unbalanced and raises a `ValueError`
+        The operators are added to the output by their prenex names, so at the end the output is only reversed and joined
         Clear some extra spaces and replace back the `ε` symbol with `eps`
         """
         out = []
-        stack = []
-        for i in range(len(regex)):
-            if isinstance(regex[i], Character):
-                out.append(regex[i])
-            elif isinstance(regex[i], Operator):
-                if regex[i] == L_BRACK:
-                    stack.append(regex[i])
-                elif regex[i] == R_BRACK:
-                    while stack[-1] != L_BRACK:
-                        out.append(stack.pop())
-                    stack.pop()
-                else:
-                    if regex[i] == STAR:
-                        while regex[i].priority <= stack[-1].priority: 
-                            out.append(stack.pop())
-                    else:
-                        while regex[i].priority < stack[-1].priority: 
-                            out.append(stack.pop())
-                    stack.append(regex[i])
-
-        # Add remaining elements to output
-        while len(stack) > 0:
-            out += stack.pop()
-
-        # Convert from regex symbols to prenex symbols (traverse the list `out` in reverse order)
-        prefix = ""
-        for i in range(len(out) - 1, -1, -1):
-            if isinstance(out[i], Operator):
-                if out[i].op == '.':
-                    prefix += "CONCAT "
-                elif out[i].op == '|':
-                    prefix += "UNION "
-                elif out[i].op == '*':
-                    prefix += "STAR "
-                elif out[i].op == '+':
-                    prefix += "PLUS "
-                elif out[i].op == '?':
-                    prefix += "MAYBE "
+        # The stack is seeded with a right bracket that opens the whole regex (as if it was wrapped in brackets),
+        # so it is never empty and the popping loops stop at it (the brackets have the lowest priority)
+        stack = [T_RB]
+        # Bind the lookups used on every item to locals
+        append = out.append
+        pop = stack.pop
+        prio = _PRIO
+        names = _NAMES
+        for tag, c in zip(reversed(tags), reversed(chars)):
+            if tag == T_CHR:
+                append(c)
+            elif tag == T_RB:
+                stack.append(tag)
+            elif tag == T_LB:
+                while stack[-1] != T_RB:
+                    append(names[pop()])
+                # The seeded right bracket doesn't belong to this left bracket
+                if len(stack) == 1:
+                    raise ValueError("Unbalanced brackets in the regex (a `(` is never closed)")
+                pop()
             else:
-                prefix += out[i].chr + " "
-            
+                p_cur = prio[tag]
+                if tag == T_STAR:
+                    while p_cur <= prio[stack[-1]]:
+                        append(names[pop()])
+                else:
+                    while p_cur < prio[stack[-1]]:
+                        append(names[pop()])
+                stack.append(tag)
+
+        # Add remaining elements to output (up to the seeded right bracket)
+        while stack[-1] != T_RB:
+            append(names[pop()])
+        # Only the seeded right bracket must be left
+        if len(stack) != 1:
+            raise ValueError("Unbalanced brackets in the regex (a `)` is never opened)")
+
+        # The output was built from right to left
+        prefix = " ".join(reversed(out)) + " "
+
         # Remove the extra spaces before and after \n, \r and \t
-        prefix = prefix.replace(" \n ", "\n")
-        prefix = prefix.replace(" \r ", "\r")
-        prefix = prefix.replace(" \t ", "\t")
+        # (most expressions have none of them, so check for the character before replacing)
+        for ws in "\n\r\t":
+            if ws in prefix:
+                prefix = prefix.replace(f" {ws} ", ws)
 
         # Replace "ε" with "eps"
-        prefix_rev = prefix[:-1].replace("ε", "eps")
+        prefix_rev = prefix[:-1]
+        if "ε" in prefix_rev:
+            prefix_rev = prefix_rev.replace("ε", "eps")
         return prefix_rev
 
 
     @staticmethod
+    @lru_cache(maxsize=512)
     def toPrenex(regex: str) -> str:
         """
         This function constructs a prenex expression out of a normal one
         It uses an algorithm for converting infix to prefix regex (prenex)
-        -> Preprocess the regex string into a list of characters and operators
-        -> Reverse the list
-        -> Swap '(' with ')' and vice versa
-        -> Add the entire regex between '(' and ')'
-        -> Call `toPrenexHelper()` to convert the list to a prenex expression
+        -> Preprocess the regex string into the tags and characters of its items
+        -> Call `toPrenexHelper()` to convert the items to a prenex expression
+        (it traverses the items in reverse, so no reversed copy of them is needed)
+        The prenex expressions are cached by regex (see `clearCache()`)
         """
-        rlist = Parser.preprocess(regex)
-        rlist = reversed(rlist)
-        infix_list = []
-        for x in rlist:
-            if x == L_BRACK:
-                infix_list.append(R_BRACK)
-            elif x == R_BRACK:
-                infix_list.append(L_BRACK)
-            else:
-                infix_list.append(x)
+        return Parser.toPrenexHelper(*Parser.preprocess(regex))
+
 
-        infix_list = [L_BRACK] + infix_list + [R_BRACK]
-        prenex = Parser.toPrenexHelper(infix_list)
-        return prenex
+    @staticmethod
+    def clearCache() -> None:
+        """ Clears the cache of `toPrenex()` (e.g. for long-running processes) """
+        Parser.toPrenex.cache_clear()
@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+# Tags for the kinds of items of a preprocessed regex (the parser works on the tags, see `Parser.py`)
+T_CHR, T_LB, T_RB, T_STAR, T_PLUS, T_MAYBE, T_UNION, T_CONCAT = range(8)
+
 class Character:
     __match_args__ = ("chr",)
 